@@ -0,0 +1,427 @@
+import os
+import re
+import json
+import time
+import glob
+import datetime
+
+"""
+Lazy reader for the session archive written by record.SessionArchive.
+
+Session files are one big JSON list of plays, so instead of json.load-ing them
+this scans the raw text for play boundaries and only decodes the parts of a
+play that a filter or the caller actually needs. Only one play's worth of text
+is held in memory at a time, no matter how big the archive is.
+"""
+
+#skips everything up to the next bracket outside of a string in one go. A
+#captured quote means a string runs off the end of the text.
+_bracket_re = re.compile(r'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*([\[\]{}"])')
+_whitespace_re = re.compile(r'[ \t\n\r]*')
+_scalar_re = re.compile(r'[^,\]}\s]*')
+
+_event_name_re = re.compile(r'\{\s*"event"\s*:\s*"([^"\\]*)"')
+
+_session_name_re = re.compile(r'session(\d{8}_\d{6})')
+
+class _Incomplete(Exception):
+    """
+    Raised when a value runs off the end of the text that has been read so far
+    """
+    pass
+
+def _skip_ws(text, pos):
+    return _whitespace_re.match(text, pos).end()
+
+def _skip_string(text, pos):
+    """
+    pos is the index of the opening quote, returns the index after the closing
+    quote
+    """
+    try:
+        _, end = json.decoder.scanstring(text, pos+1)
+    except json.JSONDecodeError:
+        raise _Incomplete()
+    return end
+
+def _skip_value(text, pos):
+    """
+    Returns the index just past the JSON value starting at pos without decoding
+    it.
+    """
+    if pos >= len(text): raise _Incomplete()
+    char = text[pos]
+    if char == '"':
+        return _skip_string(text, pos)
+    if char not in '[{':
+        end = _scalar_re.match(text, pos).end()
+        if end >= len(text): raise _Incomplete()
+        return end
+
+    depth = 0
+    while True:
+        match = _bracket_re.match(text, pos)
+        if match == None: raise _Incomplete()
+        char = match.group(1)
+        if char == '"': raise _Incomplete()
+        pos = match.end()
+        if char == '[' or char == '{':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0: return pos
+
+def _iter_members(text, pos=0):
+    """
+    Yields (key, start, end) for each member of the object starting at pos so
+    that values can be decoded individually with json.loads(text[start:end])
+    """
+    pos = _skip_ws(text, pos)
+    if text[pos] != '{': raise ValueError(f'Expected an object at {pos}')
+    pos = _skip_ws(text, pos+1)
+    if text[pos] == '}': return
+    while True:
+        key, pos = json.decoder.scanstring(text, pos+1)
+        pos = _skip_ws(text, pos)
+        pos = _skip_ws(text, pos+1) #:
+        end = _skip_value(text, pos)
+        yield key, pos, end
+        pos = _skip_ws(text, end)
+        if text[pos] == '}': return
+        pos = _skip_ws(text, pos+1) #,
+
+def _iter_elements(text, pos=0):
+    """
+    Yields (start, end) for each element of the array starting at pos
+    """
+    pos = _skip_ws(text, pos)
+    if text[pos] != '[': raise ValueError(f'Expected an array at {pos}')
+    pos = _skip_ws(text, pos+1)
+    if text[pos] == ']': return
+    while True:
+        end = _skip_value(text, pos)
+        yield pos, end
+        pos = _skip_ws(text, end)
+        if text[pos] == ']': return
+        pos = _skip_ws(text, pos+1)
+
+def _char(text, pos):
+    if pos >= len(text): raise _Incomplete()
+    return text[pos]
+
+def _scan_object(text, pos):
+    """
+    Returns ([(key, start, end), ...], end) for the members of the object
+    starting at pos, scanning it only once
+    """
+    members = []
+    pos = _skip_ws(text, pos+1)
+    if _char(text, pos) == '}': return members, pos+1
+    while True:
+        if _char(text, pos) != '"': raise ValueError(f'Expected a key at {pos}')
+        try:
+            key, pos = json.decoder.scanstring(text, pos+1)
+        except json.JSONDecodeError:
+            raise _Incomplete()
+        pos = _skip_ws(text, pos)
+        if _char(text, pos) != ':': raise ValueError(f'Expected : at {pos}')
+        pos = _skip_ws(text, pos+1)
+        end = _skip_value(text, pos)
+        members.append((key, pos, end))
+        pos = _skip_ws(text, end)
+        if _char(text, pos) == '}': return members, pos+1
+        pos = _skip_ws(text, pos+1) #,
+
+def iter_raw_objects(fp, chunk_size=1<<22):
+    """
+    Yields (raw text, members, offset) for each object in the top level JSON
+    array in fp, reading the file in chunks. members is a list of (key, start,
+    end) spans of raw, found in the same pass that finds the end of the object,
+    and offset is where raw starts in the file. Only the current object is
+    kept around.
+    """
+    name = getattr(fp, 'name', fp)
+    buf = fp.read(chunk_size)
+    base = 0 #file offset of buf[0]
+    eof = len(buf) < chunk_size
+    pos = _skip_ws(buf, 0)
+    if pos >= len(buf): return
+    if buf[pos] != '[': raise ValueError(f'{name} is not a JSON array')
+    pos += 1
+
+    while True:
+        pos = _skip_ws(buf, pos)
+        if pos < len(buf) and buf[pos] == ',': pos = _skip_ws(buf, pos+1)
+        if pos < len(buf) and buf[pos] == ']': return
+
+        try:
+            if _char(buf, pos) != '{': raise ValueError(f'{name} has a non object entry')
+            members, end = _scan_object(buf, pos)
+        except _Incomplete:
+            if eof: raise ValueError(f'Unexpected end of {name}')
+            #read at least as much as is buffered so rescans stay linear overall
+            more = fp.read(max(chunk_size, len(buf)-pos))
+            eof = len(more) == 0
+            base += pos
+            buf = buf[pos:]+more
+            pos = 0
+            continue
+
+        yield buf[pos:end], [(key, start-pos, stop-pos) for key, start, stop in members], base+pos
+        pos = end
+
+        if len(buf)-pos < chunk_size//2 and not eof:
+            more = fp.read(chunk_size)
+            eof = len(more) < chunk_size
+            base += pos
+            buf = buf[pos:]+more
+            pos = 0
+
+def _open_session(filename):
+    """
+    Session files are read as latin-1 so every character is one byte and
+    offsets can be used to seek straight back to a play later. JSON structure
+    is all ASCII, so scanning isn't affected, and _decode turns the text back
+    into the original bytes before parsing.
+    """
+    return open(filename, 'r', encoding='latin-1', newline='')
+
+def _decode(text):
+    return json.loads(text.encode('latin-1'))
+
+class RawPlay():
+    """
+    One play from a session file that hasn't been decoded yet. filename,
+    offset and length locate it in the archive, index is its position in the
+    session file and spans maps each top level key to its (start, end) in raw.
+    """
+    def __init__(self, filename, index, offset, raw, spans):
+        self.filename = filename
+        self.index = index
+        self.offset = offset
+        self.length = len(raw)
+        self.raw = raw
+        self.spans = {key: (start, end) for key, start, end in spans}
+
+    def get(self, key, default=None):
+        """
+        Decodes a single top level value
+        """
+        span = self.spans.get(key, None)
+        if span == None: return default
+        return _decode(self.raw[span[0]:span[1]])
+
+    def iter_raw_events(self, event_types=None):
+        """
+        Yields the raw text of each event, only looking at the event name of
+        each one to decide whether it matches event_types
+        """
+        span = self.spans.get('events', None)
+        if span == None: return
+
+        raw = self.raw
+        for start, end in _iter_elements(raw, span[0]):
+            if event_types != None:
+                #the monitor always writes the event name first
+                match = _event_name_re.match(raw, start)
+                if match != None:
+                    name = match.group(1)
+                else:
+                    name = None
+                    for key, kstart, kend in _iter_members(raw, start):
+                        if key == 'event':
+                            name = _decode(raw[kstart:kend])
+                            break
+                if name not in event_types: continue
+            yield raw[start:end]
+
+    def decode(self, event_types=None):
+        """
+        The play dict as stored, with only the events matching event_types
+        """
+        play = {key: self.get(key) for key in self.spans if key != 'events'}
+        play['events'] = [_decode(x) for x in self.iter_raw_events(event_types)]
+        return play
+
+    def location(self):
+        return (self.filename, self.offset, self.length)
+
+def _as_set(value):
+    if value == None: return None
+    if isinstance(value, str): return {value}
+    return set(value)
+
+def _as_ms(value):
+    """
+    datetime, date, or seconds since epoch to the millisecond timestamps the
+    mod uses
+    """
+    if value == None: return None
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()*1000
+    if isinstance(value, datetime.date):
+        return time.mktime(value.timetuple())*1000
+    return value*1000
+
+def _get_path(data, path):
+    for key in path:
+        if not isinstance(data, dict): return None
+        data = data.get(key, None)
+    return data
+
+class PlayFilter():
+    """
+    The filters for ArchiveReader.iter_plays.
+
+    map_hash, difficulty and events may be a single value or a collection of
+    allowed values, None means no filter but a collection containing None
+    matches plays without that value. modifiers is a dict of modifier values that must all match,
+    e.g. {'songSpeed': 'Normal', 'noFail': False}. since and until bound the
+    play's start time and may be datetimes, dates or seconds since epoch.
+    """
+    def __init__(self, map_hash=None, difficulty=None, modifiers=None, since=None,
+            until=None, events=None):
+        self.map_hash = _as_set(map_hash)
+        self.difficulty = _as_set(difficulty)
+        self.modifiers = modifiers
+        self.since = _as_ms(since)
+        self.until = _as_ms(until)
+        self.events = _as_set(events)
+
+    def check_file(self, filename):
+        """
+        Session files are named after when they were started, so anything
+        started after the end of the range can be skipped without opening it.
+        """
+        if self.until == None: return True
+        match = _session_name_re.search(os.path.basename(filename))
+        if match == None: return True
+        started = time.mktime(time.strptime(match.group(1), '%Y%m%d_%H%M%S'))*1000
+        return started <= self.until
+
+    def check_play(self, play, song_map):
+        """
+        play is a RawPlay. Cheapest checks go first so most plays are rejected
+        after decoding a single string.
+        """
+        map_hash = play.get('map_hash')
+        if self.map_hash != None and map_hash not in self.map_hash:
+            return False
+
+        if self.difficulty != None or self.since != None or self.until != None:
+            info = play.get('instanceinfo') or {}
+            difficulty = info.get('difficulty', song_map.get(map_hash, {}).get('difficulty', None))
+            if self.difficulty != None and difficulty not in self.difficulty:
+                return False
+            start = info.get('start_time', None)
+            if self.since != None and (start == None or start < self.since):
+                return False
+            if self.until != None and (start == None or start > self.until):
+                return False
+
+        if self.modifiers != None:
+            mods = play.get('modifiers') or {}
+            for key, val in self.modifiers.items():
+                if mods.get(key, None) != val: return False
+
+        return True
+
+class ArchiveReader():
+    """
+    Reads plays out of a directory of session*.json files and their songs.json
+    index, one play at a time.
+    """
+    def __init__(self, datadir, song_file='songs.json', pattern='session*.json', chunk_size=1<<22):
+        self.datadir = datadir
+        self.chunk_size = chunk_size
+
+        song_path = os.path.join(datadir, song_file)
+        try:
+            with open(song_path, 'r') as fp:
+                self.song_map = json.load(fp)
+        except Exception as e:
+            print(f'Failed to load song index file {song_path}: {e}')
+            self.song_map = {}
+
+        self.session_files = sorted(x for x in glob.glob(os.path.join(datadir, pattern))
+            if os.path.basename(x) != song_file)
+
+    def iter_raw_plays(self, play_filter=None):
+        """
+        Yields a RawPlay for each play passing play_filter
+        """
+        for filename in self.session_files:
+            if play_filter != None and not play_filter.check_file(filename): continue
+            with _open_session(filename) as fp:
+                for index, (raw, spans, offset) in enumerate(iter_raw_objects(fp, self.chunk_size)):
+                    play = RawPlay(filename, index, offset, raw, spans)
+                    if play_filter != None and not play_filter.check_play(play, self.song_map):
+                        continue
+                    yield play
+
+    def read_plays(self, locations, events=None):
+        """
+        Yields the play dicts at locations, (filename, offset, length) tuples
+        from RawPlay.location, seeking straight to each one instead of
+        scanning the session files
+        """
+        event_types = _as_set(events)
+        for filename, offset, length in locations:
+            with open(filename, 'rb') as fp:
+                fp.seek(offset)
+                raw = fp.read(length).decode('latin-1')
+            spans, _ = _scan_object(raw, 0)
+            yield RawPlay(filename, None, offset, raw, spans).decode(event_types)
+
+    def index_plays(self, **filters):
+        """
+        Maps each map_hash to the locations of its plays for read_plays, only
+        decoding the map_hash of each play
+        """
+        index = {}
+        for play in self.iter_raw_plays(PlayFilter(**filters)):
+            index.setdefault(play.get('map_hash'), []).append(play.location())
+        return index
+
+    def iter_plays(self, map_hash=None, difficulty=None, modifiers=None, since=None,
+            until=None, events=None):
+        """
+        Yields play dicts like the ones in the session files, with 'events'
+        holding only the events matching the events filter. See PlayFilter for
+        the filter arguments.
+        """
+        play_filter = PlayFilter(map_hash, difficulty, modifiers, since, until, events)
+        for play in self.iter_raw_plays(play_filter):
+            yield play.decode(play_filter.events)
+
+    def iter_map_hashes(self, **filters):
+        """
+        map_hash of each play without decoding anything else
+        """
+        play_filter = PlayFilter(**filters)
+        for play in self.iter_raw_plays(play_filter):
+            yield play.get('map_hash')
+
+    def iter_arrays(self, fields, dtype=float, **filters):
+        """
+        Yields (play, arrays) for each matching play where arrays maps each
+        entry of fields to a NumPy array with one value per matching event.
+
+        fields are dotted paths into the event, e.g. 'time' or
+        'noteCut.timeDeviation'. Missing values come out as nan. play is the
+        play dict without its events.
+        """
+        import numpy as np
+
+        paths = {field: field.split('.') for field in fields}
+        play_filter = PlayFilter(**filters)
+        for raw_play in self.iter_raw_plays(play_filter):
+            play = {key: raw_play.get(key) for key in raw_play.spans if key != 'events'}
+            columns = {field: [] for field in fields}
+            for event_raw in raw_play.iter_raw_events(play_filter.events):
+                event = _decode(event_raw)
+                for field, path in paths.items():
+                    val = _get_path(event, path)
+                    columns[field].append(float('nan') if val == None else val)
+            arrays = {field: np.array(vals, dtype=dtype) for field, vals in columns.items()}
+            yield play, arrays
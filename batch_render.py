@@ -0,0 +1,263 @@
+import os
+import sys
+import time
+import argparse
+import concurrent.futures
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+
+import archive
+
+"""
+Headless batch version of sample_render.py.
+
+Renders a report image for every play and every map/difficulty in one or more
+archive directories using a process pool. Images that are already newer than
+the session files they were made from are skipped, so running this nightly
+only renders new plays.
+"""
+
+def safe_name(text):
+    return ''.join(x if x.isalnum() or x in '-_+' else '_' for x in text)
+
+def play_output(outdir, filename, index):
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(outdir, 'plays', f'{stem}_{index:03d}.png')
+
+def map_output(outdir, map_hash, difficulty):
+    return os.path.join(outdir, 'maps', f'{safe_name(map_hash)}_{safe_name(str(difficulty))}.png')
+
+def is_fresh(output, sources):
+    """
+    True if output exists and is newer than every file in sources
+    """
+    try:
+        out_time = os.path.getmtime(output)
+    except OSError:
+        return False
+    return all(out_time >= os.path.getmtime(x) for x in sources)
+
+def save_figure(fig, output):
+    """
+    Writes to a temporary file first so a half written image never looks up to
+    date
+    """
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp = f'{output}.tmp'
+    fig.savefig(tmp, format='png')
+    os.replace(tmp, output)
+
+def save_placeholder(title, output):
+    """
+    Image for reports with nothing to plot, written anyway so they count as up
+    to date and don't get planned again every run
+    """
+    fig = Figure(figsize=(10, 8))
+    fig.suptitle(title)
+    fig.text(0.5, 0.5, 'No note events recorded', ha='center', va='center')
+    save_figure(fig, output)
+
+def get_map_name(map_info, difficulty):
+    return f"{map_info.get('songName', '?')} - {map_info.get('songAuthorName', '?')}\n{map_info.get('levelAuthorName', '?')} - {difficulty}"
+
+def extract_cuts(play):
+    """
+    Timing and score of each fully cut note and the times of misses, in
+    seconds since the first event of the play
+    """
+    events = play['events']
+    if len(events) == 0:
+        return None
+    start = min(x['time'] for x in events)
+
+    cuts = [x for x in events if x['event'] == 'noteFullyCut']
+    misses = [x for x in events if x['event'] == 'noteMissed']
+    return {
+        'times': [(x['time']-start)/1000 for x in cuts],
+        'timing': [x['noteCut']['timeDeviation']*1000 for x in cuts],
+        'cutscore': [x['noteCut']['finalScore']-x['noteCut']['cutDistanceScore'] for x in cuts],
+        'score': [x['noteCut']['finalScore'] for x in cuts],
+        'misses': [(x['time']-start)/1000 for x in misses],
+    }
+
+def plot_timing(ax, cuts, label=None):
+    ax.scatter(cuts['times'], cuts['timing'], s=4, label=label)
+    ax.scatter(cuts['misses'], [0 for x in cuts['misses']], c='r', marker='x', s=6)
+    ax.set_ylabel('Time Deviation (ms)')
+    ax.grid(True)
+
+def plot_score(ax, cuts, label=None):
+    ax.scatter(cuts['times'], cuts['score'], s=4, label=label)
+    ax.scatter(cuts['misses'], [0 for x in cuts['misses']], c='r', marker='x', s=6)
+    ax.set_ylabel('Score (0-115)')
+    ax.set_ylim(0, 115)
+    ax.grid(True)
+
+def render_play(play, map_info, output):
+    info = play.get('instanceinfo', {})
+    difficulty = info.get('difficulty', map_info.get('difficulty', '?'))
+    started = info.get('start_time', None)
+    started = time.strftime('%Y-%m-%d %H:%M', time.localtime(started/1000)) if started != None else '?'
+
+    cuts = extract_cuts(play)
+    if cuts == None:
+        save_placeholder(f'{get_map_name(map_info, difficulty)}\n{started}', output)
+        return True
+
+    fig = Figure(figsize=(10, 8))
+    timing_ax, score_ax = fig.subplots(2, 1, sharex=True)
+    plot_timing(timing_ax, cuts)
+    plot_score(score_ax, cuts)
+
+    perf = play.get('performance', {})
+    summary = f"{len(cuts['timing'])} cuts, {len(cuts['misses'])} misses, score {perf.get('score', '?')}, {perf.get('rank', '?')}"
+    timing_ax.set_title(f'{get_map_name(map_info, difficulty)}\n{started} - {summary}')
+    score_ax.set_xlabel('Time (seconds since start)')
+
+    save_figure(fig, output)
+    return True
+
+def render_map(plays, map_info, difficulty, output):
+    fig = Figure(figsize=(10, 8))
+    timing_ax, score_ax = fig.subplots(2, 1, sharex=True)
+    count = 0
+    for play in plays:
+        cuts = extract_cuts(play)
+        if cuts == None: continue
+        started = play.get('instanceinfo', {}).get('start_time', None)
+        label = time.strftime('%Y-%m-%d %H:%M', time.localtime(started/1000)) if started != None else None
+        plot_timing(timing_ax, cuts, label)
+        plot_score(score_ax, cuts, label)
+        count += 1
+    if count == 0:
+        save_placeholder(get_map_name(map_info, difficulty), output)
+        return True
+
+    timing_ax.set_title(f'{get_map_name(map_info, difficulty)}\n{count} plays')
+    score_ax.set_xlabel('Time (seconds since start)')
+    if count <= 10:
+        timing_ax.legend(fontsize='small')
+
+    save_figure(fig, output)
+    return True
+
+#These run in the worker processes, so everything they need is passed in
+
+def render_play_task(datadir, filename, indices, outdir):
+    """
+    Renders the plays at indices in one session file, scanning it once. The
+    indices past the last one wanted aren't scanned at all.
+    """
+    reader = archive.ArchiveReader(datadir)
+    reader.session_files = [filename]
+    wanted = set(indices)
+    last = max(wanted)
+    rendered = 0
+    for raw_play in reader.iter_raw_plays():
+        if raw_play.index > last: break
+        if raw_play.index not in wanted: continue
+        play = raw_play.decode({'noteFullyCut', 'noteMissed'})
+        map_info = reader.song_map.get(play['map_hash'], {})
+        if render_play(play, map_info, play_output(outdir, filename, raw_play.index)):
+            rendered += 1
+    return rendered
+
+def render_map_task(datadir, filenames, map_hash, difficulty, outdir):
+    reader = archive.ArchiveReader(datadir)
+    reader.session_files = filenames
+    #a bare None would mean any difficulty, [None] only matches plays without one
+    plays = reader.iter_plays(map_hash=map_hash, difficulty=[difficulty],
+        events=['noteFullyCut', 'noteMissed'])
+    map_info = reader.song_map.get(map_hash, {})
+    return 1 if render_map(plays, map_info, difficulty, map_output(outdir, map_hash, difficulty)) else 0
+
+class BatchRenderer():
+    """
+    Works out which reports are out of date for an archive directory and
+    renders them on a process pool.
+
+    The stale plays of each session file are split into tasks of up to
+    plays_per_task plays, so a single new session still gets spread over the
+    whole pool. Each task scans the session file once.
+    """
+    def __init__(self, datadir, outdir, force=False, plays_per_task=2):
+        self.datadir = datadir
+        self.outdir = outdir
+        self.force = force
+        self.plays_per_task = plays_per_task
+        self.reader = archive.ArchiveReader(datadir)
+        self.song_file = os.path.join(datadir, 'songs.json')
+
+    def plan(self):
+        """
+        Returns ({filename: [stale play indices]}, {(map_hash, difficulty):
+        [filenames]}) for the stale per-play and per-map reports. Only the
+        map_hash and instanceinfo of each play get decoded here.
+        """
+        play_tasks = {}
+        maps = {}
+        for raw_play in self.reader.iter_raw_plays():
+            filename = raw_play.filename
+            index = raw_play.index
+            map_hash = raw_play.get('map_hash')
+            info = raw_play.get('instanceinfo') or {}
+            difficulty = info.get('difficulty', self.reader.song_map.get(map_hash, {}).get('difficulty', None))
+
+            sources = maps.setdefault((map_hash, difficulty), [])
+            if filename not in sources: sources.append(filename)
+
+            if self.force or not is_fresh(play_output(self.outdir, filename, index), [filename]):
+                play_tasks.setdefault(filename, []).append(index)
+
+        map_tasks = {}
+        for (map_hash, difficulty), sources in maps.items():
+            output = map_output(self.outdir, map_hash, difficulty)
+            if self.force or not is_fresh(output, sources+[self.song_file]):
+                map_tasks[(map_hash, difficulty)] = sources
+
+        return play_tasks, map_tasks
+
+    def submit(self, pool):
+        play_tasks, map_tasks = self.plan()
+        stale_plays = sum(len(x) for x in play_tasks.values())
+        print(f'{self.datadir}: {stale_plays} plays and {len(map_tasks)} maps to render', flush=True)
+
+        futures = []
+        for filename, indices in play_tasks.items():
+            for start in range(0, len(indices), self.plays_per_task):
+                chunk = indices[start:start+self.plays_per_task]
+                futures.append(pool.submit(render_play_task, self.datadir, filename, chunk, self.outdir))
+        for (map_hash, difficulty), sources in map_tasks.items():
+            futures.append(pool.submit(render_map_task, self.datadir, sources, map_hash, difficulty, self.outdir))
+        return futures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render report images for whole session archives')
+    parser.add_argument('datadirs', nargs='+', help='archive directories with songs.json and session*.json')
+    parser.add_argument('--out', default='reports', help='reports for each archive go in a subdirectory of this')
+    parser.add_argument('--workers', type=int, default=None, help='size of the process pool, defaults to the cpu count')
+    parser.add_argument('--force', action='store_true', help='render everything even if it is up to date')
+    parser.add_argument('--plays-per-task', type=int, default=2, help='stale plays of a session file rendered by each task')
+    args = parser.parse_args()
+
+    start = time.time()
+    rendered = 0
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as pool:
+        futures = []
+        for datadir in args.datadirs:
+            outdir = os.path.join(args.out, safe_name(os.path.basename(os.path.normpath(datadir))))
+            futures.extend(BatchRenderer(datadir, outdir, args.force, args.plays_per_task).submit(pool))
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                rendered += future.result()
+            except Exception as exc:
+                print(f'Render failed: {exc}', flush=True)
+                failed += 1
+
+    print(f'Rendered {rendered} images in {time.time()-start:.1f}s with {failed} failed tasks', flush=True)
+    if failed > 0:
+        sys.exit(1)
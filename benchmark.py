@@ -0,0 +1,303 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import contextlib
+import multiprocessing
+
+try:
+    import resource
+except ImportError:
+    #not available on Windows, peak memory just won't be reported there
+    resource = None
+
+import synth_archive
+
+"""
+Benchmarks for the archive write path (record.SessionArchive), the read paths
+(archive.ArchiveReader, session_browser.App, batch_render) and their memory
+use on synthetic archives of increasing size.
+
+Archives are built with synth_archive and cached in --data-dir. Each benchmark
+runs in its own freshly spawned process so peak memory is per benchmark, and
+results are appended to --results as one JSON line per run so runs from
+different versions can be compared with --compare.
+"""
+
+def peak_rss_kb():
+    """
+    Peak memory of this process in KiB. On Linux ru_maxrss is inherited across
+    fork+exec, so a spawned worker would report the parent's peak, but VmHWM
+    starts over on exec.
+    """
+    try:
+        with open('/proc/self/status', 'r') as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    if resource == None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #macOS reports bytes, Linux reports KiB
+    if sys.platform == 'darwin': peak //= 1024
+    return peak
+
+def session_files(datadir):
+    return sorted(os.path.join(datadir, x) for x in os.listdir(datadir)
+        if x.startswith('session') and x.endswith('.json'))
+
+def archive_mb(datadir):
+    return sum(os.path.getsize(os.path.join(datadir, x)) for x in os.listdir(datadir))/2**20
+
+def bench_archive_save(datadir, songs=3):
+    """
+    Plays songs songs through a monitor with a SessionArchive loaded from the
+    largest session file and times the finished message, which is where the
+    archive gets written out.
+    """
+    import monitor
+    import record
+    import loadgen
+
+    largest = max(session_files(datadir), key=os.path.getsize)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(datadir, 'songs.json'), tmpdir)
+        shutil.copy(largest, os.path.join(tmpdir, 'session.json'))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            arch = record.SessionArchive(os.path.join(tmpdir, 'songs.json'), os.path.join(tmpdir, 'session.json'))
+        session_plays = len(arch.data)
+        bsmon = monitor.BeatSaberMonitor()
+        bsmon.message_processors.append(arch)
+        map_info = next(iter(arch.song_map.values()))
+
+        save_times = []
+        song_times = []
+        for idx in range(songs):
+            song = loadgen.SyntheticSong(map_info, event_rate=0, seed=idx)
+            messages = [loadgen.hello_message()]+[x[1] for x in song.messages()]
+            song_time = 0
+            for message in messages:
+                message['time'] = int(time.time()*1000)
+                raw = json.dumps(message)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    t = time.perf_counter()
+                    bsmon.on_message(None, raw)
+                    elapsed = time.perf_counter()-t
+                song_time += elapsed
+                if message['event'] == 'finished':
+                    save_times.append(elapsed)
+            song_times.append(song_time)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return {
+        'session_plays': session_plays,
+        'session_mb': os.path.getsize(largest)/2**20,
+        'save_s': statistics.median(save_times),
+        'song_total_s': statistics.median(song_times),
+        }
+
+def bench_reader_scan(datadir):
+    """
+    One pass over the whole archive pulling out the fully cut notes, which is
+    what the browser and renderers need
+    """
+    import archive
+
+    t = time.perf_counter()
+    reader = archive.ArchiveReader(datadir)
+    plays = 0
+    events = 0
+    for play in reader.iter_plays(events='noteFullyCut'):
+        plays += 1
+        events += len(play['events'])
+    elapsed = time.perf_counter()-t
+    return {
+        'plays': plays,
+        'events': events,
+        'scan_s': elapsed,
+        'mb_per_s': archive_mb(datadir)/max(elapsed, 1e-9),
+        }
+
+def bench_browser(datadir, switches=10):
+    """
+    session_browser.App startup up to the first drawn plot, then the time to
+    switch to the next song and draw it
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import session_browser
+
+    t = time.perf_counter()
+    app = session_browser.App(datadir)
+    app.do_plot()
+    app.fig.canvas.draw()
+    startup = time.perf_counter()-t
+
+    switch_times = []
+    for idx in range(min(switches, len(app.session_hashes))):
+        t = time.perf_counter()
+        app.cycle_song(None, 1)
+        app.fig.canvas.draw()
+        switch_times.append(time.perf_counter()-t)
+
+    return {
+        'maps': len(app.session_hashes),
+        'startup_s': startup,
+        'switch_s': statistics.median(switch_times) if switch_times else None,
+        'switch_max_s': max(switch_times) if switch_times else None,
+        }
+
+def bench_play_render(datadir):
+    """
+    Headless render of the first play in the archive, the per-play cost of
+    batch_render
+    """
+    import batch_render
+
+    filename = session_files(datadir)[0]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        t = time.perf_counter()
+        batch_render.render_play_task(datadir, filename, [0], tmpdir)
+        elapsed = time.perf_counter()-t
+    finally:
+        shutil.rmtree(tmpdir)
+    return {'render_s': elapsed}
+
+BENCHMARKS = {
+    'archive_save': bench_archive_save,
+    'reader_scan': bench_reader_scan,
+    'browser': bench_browser,
+    'play_render': bench_play_render,
+}
+
+def run_benchmark(name, datadir):
+    """
+    Entry point in the spawned process
+    """
+    start_rss = peak_rss_kb()
+    result = BENCHMARKS[name](datadir)
+    result['start_rss_kb'] = start_rss
+    result['peak_rss_kb'] = peak_rss_kb()
+    return result
+
+def run_isolated(name, datadir):
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1) as pool:
+        return pool.apply(run_benchmark, (name, datadir))
+
+def get_archive(data_dir, plays, base_songs, plays_per_session):
+    """
+    Builds the synthetic archive for a size unless an identical one is cached
+    """
+    datadir = os.path.join(data_dir, f'plays{plays}_per{plays_per_session}')
+    marker = os.path.join(datadir, 'complete')
+    if os.path.exists(marker):
+        return datadir
+
+    print(f'Generating archive with {plays} plays in {datadir}', flush=True)
+    if os.path.exists(datadir):
+        shutil.rmtree(datadir)
+    t = time.time()
+    synth_archive.build_archive(datadir, plays, base_songs, plays_per_session=plays_per_session)
+    with open(marker, 'w') as fp:
+        fp.write(f'{time.time()-t:.1f}s\n')
+    return datadir
+
+def get_version():
+    """
+    Commit of the code being benchmarked, wherever the benchmark is run from
+    """
+    repo = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo,
+            capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo,
+            capture_output=True, text=True, check=True).stdout.strip() != ''
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit+('-dirty' if dirty else '')
+
+def load_runs(results_file):
+    runs = []
+    try:
+        with open(results_file, 'r') as fp:
+            for line in fp:
+                if line.strip(): runs.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+    return runs
+
+def compare(previous, current):
+    """
+    Prints every timing and memory figure of current next to the most recent
+    earlier run that measured the same thing
+    """
+    print(f'\nComparing {current["version"]} against earlier runs')
+    for size, benches in current['results'].items():
+        for name, result in benches.items():
+            for metric, val in result.items():
+                if not (metric.endswith('_s') or metric.endswith('_kb')) or val == None:
+                    continue
+                #only there to show the interpreter's own footprint
+                if metric == 'start_rss_kb': continue
+                old = None
+                for run in reversed(previous):
+                    old = run['results'].get(size, {}).get(name, {}).get(metric, None)
+                    if old != None:
+                        old_version = run['version']
+                        break
+                if old == None or old == 0: continue
+                print(f'{size:>8} plays {name}.{metric:<16} {old:>12.4f} -> {val:>12.4f} ({val/old:.2f}x vs {old_version})')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark archive and browser load paths on synthetic archives')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='archive sizes in plays, up to 100000')
+    parser.add_argument('--benchmarks', nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    parser.add_argument('--plays-per-session', type=int, default=20)
+    parser.add_argument('--songs', default='sample_data/songs.json', help='real song index to base the maps on')
+    parser.add_argument('--data-dir', default='bench_data', help='where generated archives are cached')
+    parser.add_argument('--results', default='bench_results.jsonl', help='file the results of each run are appended to')
+    parser.add_argument('--label', default=None, help='name for this run, defaults to the git commit')
+    parser.add_argument('--compare', action='store_true', help='compare against earlier runs in the results file')
+    args = parser.parse_args()
+
+    with open(args.songs, 'r') as fp:
+        base_songs = json.load(fp)
+
+    previous = load_runs(args.results)
+    run = {
+        'version': args.label or get_version() or 'unknown',
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'plays_per_session': args.plays_per_session,
+        'results': {},
+        }
+
+    for size in args.sizes:
+        datadir = get_archive(args.data_dir, size, base_songs, args.plays_per_session)
+        results = run['results'][str(size)] = {}
+        for name in args.benchmarks:
+            print(f'{size} plays, {archive_mb(datadir):.1f}MB: {name}', flush=True)
+            results[name] = result = run_isolated(name, datadir)
+            print('    '+', '.join(f'{k}={v:.4g}' if isinstance(v, float) else f'{k}={v}' for k,v in result.items()), flush=True)
+
+    with open(args.results, 'a') as fp:
+        fp.write(json.dumps(run)+'\n')
+    print(f'Appended results to {args.results}')
+
+    if args.compare:
+        compare(previous, run)
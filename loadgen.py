@@ -0,0 +1,472 @@
+import socketserver
+import argparse
+import hashlib
+import base64
+import random
+import struct
+import heapq
+import json
+import time
+
+"""
+Synthetic Beat Saber HTTP Status traffic for stress testing the monitor.
+
+Run this instead of the game and point BeatSaberMonitor.get_ws_app at it, e.g.
+by setting host and port in config.json. Maps are taken from a songs.json
+index so note counts, lengths and wall counts look like real plays.
+"""
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+#Real games send beatmapEvent with these types and values
+BEATMAP_EVENT_TYPES = list(range(0, 5))
+BEATMAP_EVENT_VALUES = list(range(0, 8))
+
+#Minimum score/currentMaxScore for each rank, best first
+RANKS = [(1.0, 'SSS'), (0.9, 'SS'), (0.8, 'S'), (0.65, 'A'), (0.5, 'B'), (0.35, 'C'), (0.2, 'D')]
+
+def get_rank(score, max_score):
+    if max_score == 0: return 'SSS'
+    ratio = score/max_score
+    for threshold, rank in RANKS:
+        if ratio >= threshold: return rank
+    return 'E'
+
+class SyntheticSong():
+    """
+    Generates the message stream for a single play of a map.
+
+    map_info is an entry from songs.json. note_density scales the map's average
+    notes per second, event_rate is beatmapEvents per second, and miss_rate is
+    the fraction of notes that are missed instead of cut. pauses is the number
+    of times the player pauses during the song, each for pause_length seconds.
+
+    messages() yields (wall time offset in seconds, message) in time order.
+    """
+    def __init__(self, map_info, note_density=1.0, event_rate=10, miss_rate=0.05,
+            pauses=0, pause_length=2.0, seed=None):
+        self.map_info = dict(map_info)
+        self.map_info['songCover'] = None
+
+        self.length = self.map_info.get('length', 60000)/1000
+        notes_count = self.map_info.get('notesCount', int(self.length*4))
+        self.notes_count = int(note_density*notes_count)
+        self.note_rate = self.notes_count/max(self.length, 1)
+        #keep the map metadata consistent with what actually gets sent
+        self.map_info['notesCount'] = max(1, self.notes_count)
+        self.event_rate = event_rate
+        self.miss_rate = miss_rate
+        self.pauses = pauses
+        self.pause_length = pause_length
+
+        self.rng = random.Random(seed)
+
+    def note_stream(self):
+        """
+        noteCut followed by noteFullyCut once the after swing finishes, or
+        noteMissed. Exactly notesCount notes are sent, each jittered within its
+        own slot of a regular grid so they stay in order.
+        """
+        if self.notes_count <= 0: return
+        step = self.length/self.notes_count
+        #noteFullyCut can come after later notes, so hold them back until due
+        fully_cut = []
+        for note_id in range(self.notes_count):
+            t = step*(note_id+self.rng.uniform(0.25, 0.75))
+            while fully_cut and fully_cut[0][0] <= t:
+                cut_time, _, cut = heapq.heappop(fully_cut)
+                yield (cut_time, 'noteFullyCut', {'noteCut': cut})
+
+            note_type = self.rng.choice(['NoteA', 'NoteB'])
+            if self.rng.random() < self.miss_rate:
+                cut = self.make_cut(note_id, note_type, missed=True)
+                yield (t, 'noteMissed', {'noteCut': cut})
+            else:
+                cut = self.make_cut(note_id, note_type)
+                yield (t, 'noteCut', {'noteCut': cut})
+                heapq.heappush(fully_cut, (t+self.rng.uniform(0.1, 0.4), note_id, cut))
+
+        while fully_cut:
+            cut_time, _, cut = heapq.heappop(fully_cut)
+            yield (cut_time, 'noteFullyCut', {'noteCut': cut})
+
+    def event_stream(self):
+        """
+        Lighting events at a fixed rate, which is what floods the socket on
+        busy maps
+        """
+        if self.event_rate <= 0: return
+        step = 1/self.event_rate
+        t = 0
+        while t < self.length:
+            payload = {'beatmapEvent': {
+                'type': self.rng.choice(BEATMAP_EVENT_TYPES),
+                'value': self.rng.choice(BEATMAP_EVENT_VALUES),
+                }}
+            yield (t, 'beatmapEvent', payload)
+            t += step
+
+    def wall_stream(self):
+        """
+        The player clips obstaclesCount walls spread evenly through the song
+        """
+        walls = self.map_info.get('obstaclesCount', 0)
+        if walls <= 0: return
+        step = self.length/(walls+1)
+        for idx in range(walls):
+            t = step*(idx+1)
+            yield (t, 'obstacleEnter', {})
+            yield (t+min(step/2, self.rng.uniform(0.1, 1.0)), 'obstacleExit', {})
+
+    def make_cut(self, note_id, note_type, missed=False):
+        saber_type = 'SaberA' if note_type == 'NoteA' else 'SaberB'
+        if missed:
+            return {
+                'noteID': note_id,
+                'noteType': note_type,
+                'noteCutDirection': self.rng.choice(['Up', 'Down', 'Left', 'Right', 'Any']),
+                'noteLine': self.rng.randint(0, 3),
+                'noteLayer': self.rng.randint(0, 2),
+                'speedOK': False,
+                'directionOK': None,
+                'saberTypeOK': None,
+                'wasCutTooSoon': False,
+                'initialScore': None,
+                'finalScore': None,
+                'cutDistanceScore': None,
+                'multiplier': 1,
+                'saberSpeed': None,
+                'saberDir': None,
+                'saberType': None,
+                'swingRating': None,
+                'timeDeviation': None,
+                'cutDirectionDeviation': None,
+                'cutPoint': None,
+                'cutNormal': None,
+                'cutDistanceToCenter': None,
+                'timeToNextBasicNote': None,
+                }
+
+        before = min(70, int(self.rng.gauss(66, 6)))
+        after = max(0, min(30, int(self.rng.gauss(26, 5))))
+        accuracy = max(0, min(15, int(self.rng.gauss(12, 2.5))))
+        return {
+            'noteID': note_id,
+            'noteType': note_type,
+            'noteCutDirection': self.rng.choice(['Up', 'Down', 'Left', 'Right', 'Any']),
+            'noteLine': self.rng.randint(0, 3),
+            'noteLayer': self.rng.randint(0, 2),
+            'speedOK': True,
+            'directionOK': True,
+            'saberTypeOK': self.rng.random() > 0.01,
+            'wasCutTooSoon': False,
+            'initialScore': max(0, before)+accuracy,
+            'finalScore': max(0, before)+after+accuracy,
+            'cutDistanceScore': accuracy,
+            'multiplier': 1,
+            'saberSpeed': self.rng.uniform(2, 12),
+            'saberDir': [self.rng.uniform(-1, 1) for _ in range(3)],
+            'saberType': saber_type,
+            'swingRating': self.rng.uniform(0.7, 1.0),
+            'timeDeviation': self.rng.gauss(0, 0.03),
+            'cutDirectionDeviation': self.rng.gauss(0, 10),
+            'cutPoint': [self.rng.uniform(-1, 1) for _ in range(3)],
+            'cutNormal': [self.rng.uniform(-1, 1) for _ in range(3)],
+            'cutDistanceToCenter': self.rng.uniform(0, 0.3),
+            'timeToNextBasicNote': self.rng.uniform(0.1, 1.0),
+            }
+
+    def messages(self):
+        """
+        Merges the individual streams, inserts pauses and attaches a running
+        performance status the way the mod does.
+        """
+        perf = {
+            'score': 0,
+            'currentMaxScore': 0,
+            'rank': 'SSS',
+            'passedNotes': 0,
+            'hitNotes': 0,
+            'missedNotes': 0,
+            'lastNoteScore': 0,
+            'passedBombs': 0,
+            'hitBombs': 0,
+            'combo': 0,
+            'maxCombo': 0,
+            'multiplier': 1,
+            'multiplierProgress': 0,
+            'batteryEnergy': 1,
+            'softFailed': False,
+            }
+
+        pause_times = sorted(self.rng.uniform(0, self.length) for _ in range(self.pauses))
+        offset = 0
+        #the last after swing can finish after the end of the map
+        end = self.length
+
+        yield (0, self.make_message('songStart', {
+            'beatmap': self.map_info,
+            'performance': dict(perf),
+            }))
+
+        streams = heapq.merge(self.note_stream(), self.event_stream(), self.wall_stream(),
+            key=lambda x: x[0])
+        for t, event, payload in streams:
+            end = max(end, t)
+            while pause_times and pause_times[0] <= t:
+                pt = pause_times.pop(0)
+                yield (pt+offset, self.make_message('pause', {'beatmap': self.map_info}))
+                offset += self.pause_length
+                yield (pt+offset, self.make_message('resume', {'beatmap': self.map_info}))
+
+            if event == 'beatmapEvent':
+                yield (t+offset, self.make_message(event, {}, payload))
+                continue
+
+            if event == 'noteFullyCut':
+                self.update_performance(perf, payload['noteCut'])
+            elif event == 'noteMissed':
+                self.update_performance(perf, None)
+            else:
+                perf['passedNotes'] += 1 if event == 'noteCut' else 0
+
+            yield (t+offset, self.make_message(event, {'performance': dict(perf)}, payload))
+
+        yield (end+offset, self.make_message('finished', {'performance': dict(perf)}))
+        yield (end+offset+0.5, self.make_message('menu', {
+            'beatmap': None,
+            'performance': None,
+            }))
+
+    def update_performance(self, perf, cut):
+        #what the multiplier would be on a full combo
+        seen = perf['hitNotes']+perf['missedNotes']
+        max_mult = 1 if seen < 2 else 2 if seen < 6 else 4 if seen < 14 else 8
+        perf['currentMaxScore'] += 115*max_mult
+
+        if cut == None:
+            perf['passedNotes'] += 1
+            perf['missedNotes'] += 1
+            perf['combo'] = 0
+            perf['multiplier'] = max(1, perf['multiplier']//2)
+            perf['multiplierProgress'] = 0
+            perf['batteryEnergy'] = max(0, perf['batteryEnergy']-0.15)
+            perf['lastNoteScore'] = 0
+            perf['rank'] = get_rank(perf['score'], perf['currentMaxScore'])
+            return
+
+        perf['hitNotes'] += 1
+        perf['combo'] += 1
+        perf['maxCombo'] = max(perf['maxCombo'], perf['combo'])
+        perf['lastNoteScore'] = cut['finalScore']
+        #the note is scored with the multiplier from before it was hit
+        perf['score'] += cut['finalScore']*perf['multiplier']
+        perf['multiplierProgress'] += 1
+        if perf['multiplier'] < 8 and perf['multiplierProgress'] >= perf['multiplier']*2:
+            perf['multiplier'] *= 2
+            perf['multiplierProgress'] = 0
+        perf['batteryEnergy'] = min(1, perf['batteryEnergy']+0.01)
+        perf['rank'] = get_rank(perf['score'], perf['currentMaxScore'])
+
+    def make_message(self, event, status, payload=None):
+        message = {'event': event, 'time': 0, 'status': status}
+        if payload != None:
+            message.update(payload)
+        return message
+
+def hello_message():
+    return {
+        'event': 'hello',
+        'time': int(time.time()*1000),
+        'status': {
+            'game': {
+                'pluginVersion': '1.13.1',
+                'gameVersion': '1.13.2',
+                'scene': 'Menu',
+                'mode': None,
+                },
+            'beatmap': None,
+            'performance': None,
+            'mod': {
+                'multiplier': 1,
+                'obstacles': 'All',
+                'instaFail': False,
+                'noFail': False,
+                'batteryEnergy': False,
+                'batteryLives': None,
+                'disappearingArrows': False,
+                'noBombs': False,
+                'songSpeed': 'Normal',
+                'songSpeedMultiplier': 1,
+                'noArrows': False,
+                'ghostNotes': False,
+                'failOnSaberClash': False,
+                'strictAngles': False,
+                'fastNotes': False,
+                },
+            'playerSettings': {
+                'staticLights': False,
+                'leftHanded': False,
+                'playerHeight': 1.7,
+                'sfxVolume': 0.7,
+                'reduceDebris': False,
+                'noHUD': False,
+                'advancedHUD': False,
+                'autoRestart': False,
+                },
+            },
+        }
+
+def ws_frame(text):
+    """
+    Unmasked server -> client text frame
+    """
+    data = text.encode('utf-8')
+    length = len(data)
+    if length < 126:
+        header = struct.pack('!BB', 0x81, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x81, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x81, 127, length)
+    return header+data
+
+class LoadGenHandler(socketserver.BaseRequestHandler):
+    """
+    Does just enough of the websocket handshake for websocket-client and then
+    plays the configured songs at the client until it hangs up.
+    """
+    def handshake(self):
+        request = b''
+        while b'\r\n\r\n' not in request:
+            chunk = self.request.recv(4096)
+            if not chunk: return False
+            request += chunk
+
+        headers = {}
+        for line in request.decode('latin-1').split('\r\n')[1:]:
+            if ':' in line:
+                key, val = line.split(':', 1)
+                headers[key.strip().lower()] = val.strip()
+
+        key = headers.get('sec-websocket-key', None)
+        if key == None: return False
+        accept = base64.b64encode(hashlib.sha1((key+WS_GUID).encode()).digest()).decode()
+        self.request.sendall((
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Accept: {accept}\r\n\r\n'
+            ).encode())
+        return True
+
+    def send(self, message, stamp):
+        message['time'] = int(stamp*1000)
+        self.request.sendall(ws_frame(json.dumps(message)))
+
+    def handle(self):
+        cfg = self.server.config
+        if not self.handshake(): return
+        print(f'Client connected from {self.client_address}', flush=True)
+
+        try:
+            self.send(hello_message(), time.time())
+            self.play(cfg)
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError) as exc:
+            print(f'Client {self.client_address} disconnected: {exc}', flush=True)
+
+    def play(self, cfg):
+        songs = list(cfg['songs'].values())
+        event_rate = cfg['event_rate']
+        rounds = 0
+        while True:
+            for idx, map_info in enumerate(songs):
+                #every song and round gets its own pattern but stays reproducible
+                seed = None if cfg['seed'] == None else cfg['seed']*1000+rounds*len(songs)+idx
+                song = SyntheticSong(map_info,
+                    note_density=cfg['note_density'],
+                    event_rate=event_rate,
+                    miss_rate=cfg['miss_rate'],
+                    pauses=cfg['pauses'],
+                    pause_length=cfg['pause_length'],
+                    seed=seed,
+                    )
+                self.play_song(song, cfg['speed'])
+                time.sleep(cfg['gap'])
+                event_rate *= cfg['ramp']
+            rounds += 1
+            if not cfg['loop']: break
+        print(f'Finished {rounds} rounds for {self.client_address}', flush=True)
+
+    def play_song(self, song, speed):
+        """
+        Messages are stamped with when they were supposed to be sent, so a
+        client that stops reading shows up as lag rather than a slower song.
+        """
+        print(f'Playing {song.map_info.get("songName", "?")} at {song.note_rate:.1f} notes/s and {song.event_rate:.1f} events/s', flush=True)
+        start = time.time()
+        sent = 0
+        late = 0
+        for offset, message in song.messages():
+            stamp = start+offset/speed
+            if message['event'] == 'songStart':
+                message['status']['beatmap']['start'] = int(stamp*1000)
+            delay = stamp-time.time()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -0.05:
+                late += 1
+            self.send(message, stamp)
+            sent += 1
+        elapsed = time.time()-start
+        print(f'Sent {sent} messages in {elapsed:.2f}s ({sent/max(elapsed, 1e-6):.0f}/s), {late} more than 50ms late', flush=True)
+
+class LoadGenServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        self.config = config
+        super().__init__(address, LoadGenHandler)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Synthetic Beat Saber HTTP Status server')
+    parser.add_argument('--songs', default='songs.json', help='song index to take maps from')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6557)
+    parser.add_argument('--note-density', type=float, default=1.0, help='multiplier on each map\'s notes per second')
+    parser.add_argument('--event-rate', type=float, default=10, help='beatmapEvents per second')
+    parser.add_argument('--ramp', type=float, default=1.0, help='multiply the event rate by this after every song')
+    parser.add_argument('--miss-rate', type=float, default=0.05)
+    parser.add_argument('--pauses', type=int, default=0, help='pauses per song')
+    parser.add_argument('--pause-length', type=float, default=2.0)
+    parser.add_argument('--speed', type=float, default=1.0, help='play songs this many times faster')
+    parser.add_argument('--gap', type=float, default=1.0, help='seconds in the menu between songs')
+    parser.add_argument('--loop', action='store_true', help='keep cycling through the songs')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.songs, 'r') as fp:
+        songs = json.load(fp)
+
+    config = {
+        'songs': songs,
+        'note_density': args.note_density,
+        'event_rate': args.event_rate,
+        'ramp': args.ramp,
+        'miss_rate': args.miss_rate,
+        'pauses': args.pauses,
+        'pause_length': args.pause_length,
+        'speed': args.speed,
+        'gap': args.gap,
+        'loop': args.loop,
+        'seed': args.seed,
+        }
+
+    server = LoadGenServer((args.host, args.port), config)
+    print(f'Serving {len(songs)} maps on ws://{args.host}:{args.port}/socket', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
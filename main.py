@@ -3,6 +3,7 @@ import json
 import os
 import time
 import math
+import argparse
 
 import monitor
 
@@ -12,11 +13,22 @@ Loopmidi needs to be running with an appropriatedly named port
 
 import midi
 import record
+import profiler
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description='Beat Saber HTTP Status to midi')
+    parser.add_argument('--profile', nargs='?', const='.', default=None, metavar='DIR',
+        help='profile decoding, processors and GC, writing a report to DIR at the end of each song')
+    parser.add_argument('--profile-alloc', action='store_true',
+        help='also track allocations per step with tracemalloc, this slows the monitor down a lot')
+    args = parser.parse_args()
+
     config = {
-        'midi_port': 'beatsaber'
+        'midi_port': 'beatsaber',
+        'host': '127.0.0.1', #point these at loadgen.py for stress testing
+        'port': 6557,
+        'shed_thresholds': [0.05, 0.15, 0.5], #lag in seconds for each load shedding level
         }
     try:
         cfgs = json.load(open('config.json', 'r'))
@@ -26,7 +38,7 @@ if __name__ == "__main__":
 
     midi_out = midi.init_midi(config['midi_port'])
 
-    bsmon = monitor.BeatSaberMonitor()
+    bsmon = monitor.BeatSaberMonitor(config['shed_thresholds'])
 
     bsmon.message_processors.extend([
         midi.BlockCutNoteGenerator(0,1),
@@ -36,15 +48,25 @@ if __name__ == "__main__":
         midi.SongBPMNote(channel = 5), #in a song w/ bpm info
         midi.EventNoteGate('pause', ['resume','menu'], channel=6), #song paused
         midi.PerformanceCCGenerator(),
+        midi.RollingStatsCCGenerator(), #timing/accuracy/streak stats over recent cuts
         midi.MidiNoteCleanup(), #Stops notes at the end of the song
         record.SessionArchive('songs.json', f'session{time.strftime("%Y%m%d_%H%M%S")}.json'),
         ])
 
 
-    ws = bsmon.get_ws_app()
+    if args.profile == None and args.profile_alloc:
+        args.profile = '.'
+    if args.profile != None:
+        bsmon.profiler = profiler.MonitorProfiler(args.profile, args.profile_alloc)
+        print(bsmon.profiler, flush=True)
+
+    ws = bsmon.get_ws_app(config['host'], config['port'])
 
     print("Started, Connecting to Beat Saber...", flush=True)
     ws.run_forever()
+
+    #in case the connection never closed cleanly, e.g. on ctrl-c
+    bsmon.flush()
        
     midi_out.close()   
     
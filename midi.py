@@ -2,6 +2,7 @@ import time
 import os
 import json
 import math
+import array
 
 import mido
 
@@ -250,6 +251,12 @@ class PerformanceCCGenerator(MidiNoteGenerator):
 
     cc_map maps the different CC parameters this class can generate by name to
     midi CC codes.
+
+    When the monitor is shedding load at SHED_COALESCE or above, CC updates
+    are sent at most every coalesce_interval seconds, since intermediate
+    states would be overwritten anyway. The newest update held back is sent
+    with the first message after the interval, on pause, or once shedding
+    drops below SHED_COALESCE, so the CC's never stay on a stale state.
     """
     cc_map_default = {
         'score': 0, #current score percentage
@@ -272,11 +279,15 @@ class PerformanceCCGenerator(MidiNoteGenerator):
         'fullcombo': 1,
     }
 
-    def __init__(self, cc_map = None, channel=0):
+    def __init__(self, cc_map = None, channel=0, coalesce_interval=0.05):
         self.channel = channel
+        self.coalesce_interval = coalesce_interval
+        self.last_update = 0
+        #newest CC values held back by coalescing
+        self.pending_ccs = None
         self.cc_map = dict(self.cc_map_default)
         if cc_map != None:
-            self.cc_map.update(cc_map_default)
+            self.cc_map.update(cc_map)
         
         #The previous value of each cc so that it doesn't send needless messages
         self.cc_memory = {k: None for k,v in self.cc_map.items()}
@@ -293,8 +304,39 @@ class PerformanceCCGenerator(MidiNoteGenerator):
             self.cc_memory[key] = val
 
     def clear_ccs(self):
+        self.pending_ccs = None
         self.update_ccs(self.cc_rest_values)
 
+    def send_ccs(self, monitor, message, data):
+        """
+        update_ccs, but coalesced while the monitor is shedding load
+        """
+        if monitor.shed_level >= monitor.SHED_COALESCE and message['event'] != 'pause':
+            now = time.time()
+            if now-self.last_update < self.coalesce_interval:
+                monitor.record_shed('coalesced CC updates')
+                self.pending_ccs = data
+                return
+            self.last_update = now
+        self.pending_ccs = None
+        self.update_ccs(data)
+
+    def flush_ccs(self, monitor, message):
+        """
+        Sends the update held back by send_ccs once it is due, for messages
+        that don't bring new CC values of their own
+        """
+        if self.pending_ccs == None: return False
+        if monitor.shed_level >= monitor.SHED_COALESCE and message['event'] != 'pause':
+            now = time.time()
+            if now-self.last_update < self.coalesce_interval:
+                return False
+            self.last_update = now
+        data = self.pending_ccs
+        self.pending_ccs = None
+        self.update_ccs(data)
+        return True
+
     def process(self, monitor, message):
         if self.is_abort(message):
             self.clear_ccs()
@@ -303,7 +345,7 @@ class PerformanceCCGenerator(MidiNoteGenerator):
         perf = message['status'].get('performance', None)
         if perf == None: 
             if message['event'] == 'hello': return False
-            return None
+            return False if self.flush_ccs(monitor, message) else None
 
         data = {}
 
@@ -323,12 +365,201 @@ class PerformanceCCGenerator(MidiNoteGenerator):
 
         data['fullcombo'] = 1 if perf['combo'] == perf['passedNotes'] else 0
 
-        self.update_ccs(data)
+        self.send_ccs(monitor, message, data)
         return False
 
     def __str__(self):
         return f'Performance to CC Generator'
 
+class RingBuffer():
+    """
+    Fixed size window of floats that keeps a running sum and sum of squares so
+    the mean and variance are O(1) to update and read. Storage is allocated
+    once up front.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.values = array.array('d', [0.0])*size
+        self.clear()
+
+    def clear(self):
+        for idx in range(self.size):
+            self.values[idx] = 0.0
+        self.count = 0
+        self.index = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def push(self, val):
+        if self.count == self.size:
+            old = self.values[self.index]
+            self.total -= old
+            self.total_sq -= old*old
+        else:
+            self.count += 1
+        self.values[self.index] = val
+        self.total += val
+        self.total_sq += val*val
+        self.index = (self.index+1)%self.size
+
+    def mean(self, default=0.0):
+        if self.count == 0: return default
+        return self.total/self.count
+
+    def variance(self, default=0.0):
+        if self.count == 0: return default
+        mean = self.total/self.count
+        #running sums can drift slightly negative
+        return max(0.0, self.total_sq/self.count-mean*mean)
+
+class RollingStatsCCGenerator(PerformanceCCGenerator):
+    """
+    Maps rolling statistics over recent cuts to midi CC's. Every update is O(1)
+    and works on preallocated ring buffers, so this is cheap enough to run on
+    every cut.
+
+    timing_* are based on the noteCut timeDeviation in seconds. timing_ewma
+    and timing_mean map -timing_range..timing_range to 0-1 with 0.5 being
+    perfectly on time, timing_std maps 0..timing_range to 0-1.
+
+    left_accuracy and right_accuracy are the average cutDistanceScore over the
+    last window notes for each saber, with misses counting as 0.
+
+    streak is the number of consecutive cuts scoring at least streak_score,
+    reaching 1 at streak_max.
+
+    The raw stats are also written to monitor.current_stats for other
+    processors to use. They are updated on every cut even while the CC sends
+    are being coalesced.
+    """
+    cc_map_default = {
+        'timing_ewma': 20,
+        'timing_mean': 21,
+        'timing_std': 22,
+        'left_accuracy': 23,
+        'right_accuracy': 24,
+        'streak': 25,
+    }
+
+    cc_rest_values = {
+        'timing_ewma': 0.5,
+        'timing_mean': 0.5,
+        'timing_std': 0,
+        'left_accuracy': 1,
+        'right_accuracy': 1,
+        'streak': 0,
+    }
+
+    def __init__(self, cc_map = None, channel=0, window=32, alpha=0.1,
+            timing_range=0.1, streak_score=110, streak_max=64, coalesce_interval=0.05):
+        self.window = window
+        self.alpha = alpha
+        self.timing_range = timing_range
+        self.streak_score = streak_score
+        self.streak_max = streak_max
+
+        self.timing = RingBuffer(window)
+        self.accuracy = {
+            'SaberA': RingBuffer(window),
+            'SaberB': RingBuffer(window),
+        }
+
+        self.stats = {}
+        #filled in by cc_values instead of building a new dict per cut
+        self.ccs = {}
+        self.reset()
+
+        super().__init__(cc_map, channel, coalesce_interval)
+
+    def reset(self):
+        self.timing.clear()
+        for buf in self.accuracy.values():
+            buf.clear()
+
+        self.stats['timing_ewma'] = 0.0
+        self.stats['timing_mean'] = 0.0
+        self.stats['timing_std'] = 0.0
+        self.stats['left_accuracy'] = 1.0
+        self.stats['right_accuracy'] = 1.0
+        self.stats['streak'] = 0
+        self.stats['best_streak'] = 0
+
+    def add_cut(self, cut):
+        deviation = cut['timeDeviation']
+        if self.timing.count == 0:
+            self.stats['timing_ewma'] = deviation
+        else:
+            ewma = self.stats['timing_ewma']
+            self.stats['timing_ewma'] = ewma+self.alpha*(deviation-ewma)
+        self.timing.push(deviation)
+        self.stats['timing_mean'] = self.timing.mean()
+        self.stats['timing_std'] = math.sqrt(self.timing.variance())
+
+        buf = self.accuracy.get(cut['saberType'], None)
+        if buf != None:
+            buf.push(cut['cutDistanceScore']/15)
+
+        if cut['finalScore'] >= self.streak_score:
+            self.stats['streak'] += 1
+            self.stats['best_streak'] = max(self.stats['best_streak'], self.stats['streak'])
+        else:
+            self.stats['streak'] = 0
+
+        self.update_accuracy()
+
+    def add_miss(self, cut):
+        saber_type = 'SaberA' if cut['noteType'] == 'NoteA' else 'SaberB'
+        self.accuracy[saber_type].push(0.0)
+        self.stats['streak'] = 0
+        self.update_accuracy()
+
+    def update_accuracy(self):
+        self.stats['left_accuracy'] = self.accuracy['SaberA'].mean(1.0)
+        self.stats['right_accuracy'] = self.accuracy['SaberB'].mean(1.0)
+
+    def quantize(self, val):
+        """
+        Clip to 0-1 and round to the CC resolution so unchanged CC values
+        don't get sent again
+        """
+        return round(min(1, max(0, val))*127)/127
+
+    def cc_values(self):
+        stats = self.stats
+        rng = self.timing_range
+        ccs = self.ccs
+        ccs['timing_ewma'] = self.quantize(0.5+stats['timing_ewma']/(2*rng))
+        ccs['timing_mean'] = self.quantize(0.5+stats['timing_mean']/(2*rng))
+        ccs['timing_std'] = self.quantize(stats['timing_std']/rng)
+        ccs['left_accuracy'] = self.quantize(stats['left_accuracy'])
+        ccs['right_accuracy'] = self.quantize(stats['right_accuracy'])
+        ccs['streak'] = self.quantize(stats['streak']/self.streak_max)
+        return ccs
+
+    def process(self, monitor, message):
+        event = message['event']
+        if self.is_abort(message):
+            self.clear_ccs()
+            return False
+        elif event == 'songStart':
+            self.reset()
+        elif event == 'noteFullyCut':
+            self.add_cut(message['noteCut'])
+        elif event == 'noteMissed':
+            self.add_miss(message['noteCut'])
+        elif event == 'hello':
+            monitor.current_stats.update(self.stats)
+            return False
+        else:
+            return False if self.flush_ccs(monitor, message) else None
+
+        monitor.current_stats.update(self.stats)
+        self.send_ccs(monitor, message, self.cc_values())
+        return False
+
+    def __str__(self):
+        return f'Rolling Stats to CC Generator over {self.window} notes'
+
 #Initialization of midi port
 
 global_midi_out = None
@@ -8,7 +8,18 @@ import traceback
 
 class BeatSaberMonitor():
 
-    def __init__(self):
+    #Load shedding levels, each one includes the ones before it
+    SHED_NONE = 0
+    SHED_EVENTS = 1 #beatmapEvents are dropped before any processor sees them
+    SHED_COALESCE = 2 #CC generators only send the latest state every so often
+    SHED_DEFER = 3 #archive saves wait until the monitor catches up
+
+    def __init__(self, shed_thresholds = (0.05, 0.15, 0.5), shed_recover = 0.5):
+        """
+        shed_thresholds is the lag in seconds at which each shedding level
+        kicks in. A level is left again once the lag drops below shed_recover
+        times its threshold.
+        """
         
         self.wscallbacks = {
             'on_message': lambda x,y: self.on_message(x,y),
@@ -26,10 +37,25 @@ class BeatSaberMonitor():
         self.current_playersettings = {}
         self.current_gameinfo = {}
 
+        #derived stats that processors can share, e.g. RollingStatsCCGenerator
+        self.current_stats = {}
+
         self.in_map = False
         self.paused = False
         self.softfailed = False
 
+        #set to a profiler.MonitorProfiler to time each step of on_message
+        self.profiler = None
+
+        #how far behind the game the monitor is and what it is skipping to catch up
+        self.shed_thresholds = shed_thresholds
+        self.shed_recover = shed_recover
+        self.shed_level = self.SHED_NONE
+        self.lag = 0
+        self.max_lag = 0
+        self.lag_offset = None
+        self.shed_counts = {}
+
     def update_state(self, message):
         status = message['status']
         self.current_map = status.get('beatmap', self.current_map)
@@ -38,18 +64,68 @@ class BeatSaberMonitor():
         self.current_playersettings = status.get('playerSettings', self.current_playersettings)
         self.current_gameinfo = status.get('game', self.current_gameinfo)
 
+    def record_shed(self, kind, count=1):
+        """
+        Processors call this when they skip work because of shed_level
+        """
+        self.shed_counts[kind] = self.shed_counts.get(kind, 0)+count
+
+    def report_shed(self):
+        if len(self.shed_counts) == 0: return
+        summary = ', '.join(f'{v} {k}' for k,v in self.shed_counts.items())
+        print(f'Load shedding skipped {summary} (max lag {self.max_lag*1000:.1f}ms)', flush=True)
+        self.shed_counts = {}
+        self.max_lag = 0
+
+    def update_lag(self, receive_time, message_time):
+        """
+        Lag is receive time minus the message's own timestamp. The smallest
+        difference seen so far is taken as zero so a constant clock offset
+        between the game and the monitor doesn't count as lag.
+        """
+        raw_lag = receive_time-message_time
+        if self.lag_offset == None or raw_lag < self.lag_offset:
+            self.lag_offset = raw_lag
+        self.lag = lag = raw_lag-self.lag_offset
+        self.max_lag = max(self.max_lag, lag)
+
+        level = self.shed_level
+        while level < len(self.shed_thresholds) and lag >= self.shed_thresholds[level]:
+            level += 1
+        while level > self.SHED_NONE and lag < self.shed_thresholds[level-1]*self.shed_recover:
+            level -= 1
+
+        if level != self.shed_level:
+            print(f'Lag {lag*1000:.1f}ms, load shedding level {self.shed_level} -> {level}', flush=True)
+            self.shed_level = level
+            if level == self.SHED_NONE:
+                self.report_shed()
+
     def on_message(self, ws, message):
+        receive_time = time.time()
+        profiler = self.profiler
         try:
+            if profiler != None:
+                profiler.begin_message()
+                profiler.start('JSON decode')
             message=json.loads(message)
+            if profiler != None: profiler.stop()
             start_time = message['time']/1000
             event = message['event']
             #print(f'Message received: {event}', flush=True)
 
             self.update_state(message)
+            self.update_lag(receive_time, start_time)
 
             hit = False
             lines = []
-            for processor in self.message_processors:
+            processors = self.message_processors
+            if event == 'beatmapEvent' and self.shed_level >= self.SHED_EVENTS:
+                self.record_shed('beatmapEvents')
+                processors = []
+
+            for processor in processors:
+                if profiler != None: profiler.start(processor)
                 try:
                     result = processor.process(self, message)
                     if result == False:
@@ -61,6 +137,8 @@ class BeatSaberMonitor():
                 except Exception as exc:
                     print(f'Exception while running {processor}')
                     traceback.print_exc()
+                finally:
+                    if profiler != None: profiler.stop()
                     
             if hit:
                 print(f'Event {event} received by the following processors:')
@@ -68,11 +146,15 @@ class BeatSaberMonitor():
             elif not hit and False:
                 print(f'Did not process event {event}')
 
+            #quitting from the pause menu goes straight to menu
+            song_ended = event in ['finished', 'failed'] or (event == 'menu' and self.in_map)
+
             #Game state transitions
             if event in ['finished', 'failed', 'menu']:
                 self.in_map = False
                 self.paused = False
                 print(f'Exited map')
+                self.report_shed()
             elif event == 'songStart':
                 print('\n'*20)
                 print(f'Entered map')
@@ -85,6 +167,15 @@ class BeatSaberMonitor():
             elif event == 'softFailed':
                 self.softfailed = True
 
+            #after the state transitions so a failing report can't leave us in a map
+            if profiler != None:
+                profiler.end_message(start_time)
+                if song_ended:
+                    try:
+                        profiler.report(event)
+                    except Exception as exc:
+                        print(f'Failed to write profile report')
+                        traceback.print_exc()
 
         except Exception as e:
             print(f'Error processing message {message}:\n')
@@ -102,6 +193,20 @@ class BeatSaberMonitor():
     
     def on_close(self, ws):
         print(f'Connection closed', flush=True)
+        self.flush()
+
+    def flush(self):
+        """
+        Lets processors finish any work they put off while shedding load, e.g.
+        a deferred archive save, since no later message will trigger it
+        """
+        for processor in self.message_processors:
+            flush = getattr(processor, 'flush', None)
+            if flush == None: continue
+            try:
+                flush()
+            except Exception as e:
+                print(f'Failed to flush {processor}: {e}', flush=True)
 
     def get_ws_app(self, host = '127.0.0.1', port = 6557):
         """
@@ -0,0 +1,199 @@
+import os
+import gc
+import time
+import tracemalloc
+
+"""
+Low overhead profiling for the live monitor.
+
+BeatSaberMonitor calls start/stop around the JSON decode and around each
+message processor, and report at the end of every song. Timing uses the
+thread CPU clock and perf_counter and garbage collections are timed through
+gc.callbacks, which is cheap enough to leave on. Allocation tracking uses
+tracemalloc's traced memory counters per step plus a full snapshot only when
+reporting, but tracemalloc slows every allocation down so it is opt in.
+"""
+
+class StepStats():
+    """
+    Accumulated cost of one step (decode or a processor) between reports
+    """
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.max_wall = 0.0
+        self.cpu = 0.0
+        self.alloc = 0
+        self.peak = 0
+
+class MonitorProfiler():
+    """
+    Attributes CPU time, wall time and allocations to each monitor step and
+    writes a report to report_dir whenever a song ends.
+
+    Set BeatSaberMonitor.profiler to an instance of this to enable it.
+    Allocations are only tracked if alloc is True, trace_frames is how many
+    frames tracemalloc keeps per allocation and top is how many allocation
+    sites to list in each report.
+    """
+    def __init__(self, report_dir='.', alloc=False, trace_frames=1, top=10):
+        self.report_dir = report_dir
+        self.alloc = alloc
+        self.top = top
+        self.filename = os.path.join(report_dir, f'profile{time.strftime("%Y%m%d_%H%M%S")}.txt')
+        os.makedirs(report_dir, exist_ok=True)
+
+        self.snapshot = None
+        if self.alloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(trace_frames)
+            self.snapshot = self.take_snapshot()
+
+        gc.callbacks.append(self.gc_callback)
+
+        self.current = None
+        self.start_wall = 0.0
+        self.start_cpu = 0.0
+        self.start_mem = 0
+
+        self.message_start = 0.0
+        self.gc_start = 0.0
+        self.clear()
+
+    def clear(self):
+        self.steps = {}
+        self.messages = 0
+        self.message_wall = 0.0
+        self.max_message_wall = 0.0
+        self.max_lag = 0.0
+        self.gc_counts = [0, 0, 0]
+        self.gc_times = [0.0, 0.0, 0.0]
+        self.gc_during = {}
+        self.period_start = time.time()
+
+    def close(self):
+        if self.gc_callback in gc.callbacks:
+            gc.callbacks.remove(self.gc_callback)
+        if self.alloc:
+            tracemalloc.stop()
+
+    def begin_message(self):
+        self.message_start = time.perf_counter()
+
+    def end_message(self, message_time):
+        """
+        message_time is the message's own timestamp in seconds so that the lag
+        behind the game can be tracked as well
+        """
+        wall = time.perf_counter()-self.message_start
+        self.messages += 1
+        self.message_wall += wall
+        self.max_message_wall = max(self.max_message_wall, wall)
+        if message_time != None:
+            self.max_lag = max(self.max_lag, time.time()-message_time)
+
+    def start(self, key):
+        self.current = key
+        if self.alloc:
+            tracemalloc.reset_peak()
+            self.start_mem = tracemalloc.get_traced_memory()[0]
+        #the clocks are read in the opposite order in stop so that neither one
+        #covers the cost of reading the other
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.thread_time()
+
+    def stop(self):
+        cpu = time.thread_time()-self.start_cpu
+        wall = time.perf_counter()-self.start_wall
+        if self.alloc:
+            mem, peak = tracemalloc.get_traced_memory()
+
+        stats = self.steps.get(self.current, None)
+        if stats == None:
+            stats = self.steps[self.current] = StepStats()
+        stats.calls += 1
+        stats.wall += wall
+        stats.max_wall = max(stats.max_wall, wall)
+        stats.cpu += cpu
+        if self.alloc:
+            stats.alloc += max(0, mem-self.start_mem)
+            stats.peak = max(stats.peak, peak-self.start_mem)
+
+        self.current = None
+
+    def gc_callback(self, phase, info):
+        if phase == 'start':
+            self.gc_start = time.perf_counter()
+            return
+        elapsed = time.perf_counter()-self.gc_start
+        gen = info['generation']
+        self.gc_counts[gen] += 1
+        self.gc_times[gen] += elapsed
+        key = self.current if self.current != None else 'between steps'
+        self.gc_during[key] = self.gc_during.get(key, 0.0)+elapsed
+
+    def take_snapshot(self):
+        snapshot = tracemalloc.take_snapshot()
+        return snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            ])
+
+    def step_name(self, key):
+        if isinstance(key, str): return key
+        return str(key)
+
+    def format_report(self, reason):
+        lines = []
+        elapsed = time.time()-self.period_start
+        lines.append(f'Profile at {time.strftime("%Y-%m-%d %H:%M:%S")} ({reason}) covering {elapsed:.1f}s')
+        mean_wall = self.message_wall/max(1, self.messages)
+        lines.append(f'{self.messages} messages, mean {mean_wall*1e6:.0f}us, max {self.max_message_wall*1000:.2f}ms, max lag {self.max_lag*1000:.1f}ms')
+        lines.append('')
+
+        header = f'{"step":<60} {"calls":>7} {"wall ms":>9} {"max ms":>8} {"cpu ms":>9}'
+        if self.alloc:
+            header += f' {"alloc KiB":>10} {"peak KiB":>9}'
+        lines.append(header)
+        order = sorted(self.steps.items(), key=lambda x: -x[1].wall)
+        for key, stats in order:
+            name = self.step_name(key)[:60]
+            line = f'{name:<60} {stats.calls:>7} {stats.wall*1000:>9.2f} {stats.max_wall*1000:>8.2f} {stats.cpu*1000:>9.2f}'
+            if self.alloc:
+                line += f' {stats.alloc/1024:>10.1f} {stats.peak/1024:>9.1f}'
+            lines.append(line)
+        lines.append('')
+
+        gc_total = sum(self.gc_times)
+        gc_summary = ', '.join(f'gen{gen} {count}x {t*1000:.2f}ms' for gen, (count, t) in enumerate(zip(self.gc_counts, self.gc_times)))
+        lines.append(f'GC {gc_total*1000:.2f}ms total: {gc_summary}')
+        for key, t in sorted(self.gc_during.items(), key=lambda x: -x[1]):
+            lines.append(f'    during {self.step_name(key)}: {t*1000:.2f}ms')
+        lines.append('')
+
+        if self.alloc:
+            snapshot = self.take_snapshot()
+            lines.append(f'Top {self.top} allocation sites since last report:')
+            for diff in snapshot.compare_to(self.snapshot, 'lineno')[:self.top]:
+                frame = diff.traceback[0]
+                lines.append(f'    {frame.filename}:{frame.lineno} {diff.size_diff/1024:+.1f} KiB ({diff.count_diff:+d} blocks), {diff.size/1024:.1f} KiB live')
+            self.snapshot = snapshot
+            lines.append('')
+
+        return '\n'.join(lines)
+
+    def report(self, reason):
+        """
+        Writes everything collected since the last report and starts over
+        """
+        report = self.format_report(reason)
+        with open(self.filename, 'a') as fp:
+            fp.write(report)
+            fp.write('\n')
+        print(report, flush=True)
+        print(f'Wrote profile report to {self.filename}', flush=True)
+        self.clear()
+
+    def __str__(self):
+        alloc = ' with allocation tracking' if self.alloc else ''
+        return f'Monitor profiler{alloc} writing to {self.filename}'
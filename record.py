@@ -3,6 +3,7 @@ import os
 import json
 import math
 import hashlib
+import threading
 
 class SessionArchive():
     def __init__(self, song_file, session_filename):
@@ -12,6 +13,11 @@ class SessionArchive():
         self.song_filename = song_file
         self.session_filename = session_filename
 
+        #set when a save was put off because the monitor was falling behind
+        self.save_pending = False
+        #deferred saves are written on this so they can't stall the next song
+        self.save_thread = None
+
         try:
             with open(self.song_filename,'r') as fp:
                 self.song_map = json.load(fp)
@@ -38,16 +44,46 @@ class SessionArchive():
             'map_hash': '',
             }
 
-    def save(self):
-        #TODO thread this so it can't block the monitor and break the connection
+    def save(self, background=False):
+        #TODO thread every save so it can't block the monitor and break the connection
+        if self.save_thread != None:
+            #an older snapshot must never land after this one
+            self.save_thread.join()
+            self.save_thread = None
+
+        #shallow copies so plays added while a background save runs aren't half written
+        song_map = dict(self.song_map)
+        data = list(self.data)
+        if not background:
+            self.write(song_map, data)
+            return
+
+        self.save_thread = threading.Thread(target=self.write, args=(song_map, data), daemon=True)
+        self.save_thread.start()
+
+    def write(self, song_map, data):
         with open(self.song_filename, 'w') as fp:
-            json.dump(self.song_map, fp)
+            json.dump(song_map, fp)
         print(f'Saved song index {self.song_filename}')
 
         with open(self.session_filename, 'w') as fp:
-            json.dump(self.data, fp)
+            json.dump(data, fp)
         print(f'Saved archive {self.session_filename}')
 
+    def flush(self):
+        """
+        Writes out a save that was deferred while the monitor was behind and
+        waits for any background save, called by the monitor when the
+        connection closes
+        """
+        if self.save_pending:
+            print(f'Saving deferred archive before exit')
+            self.save_pending = False
+            self.save()
+        if self.save_thread != None:
+            self.save_thread.join()
+            self.save_thread = None
+
     def get_map_hash(self, map_info):
         if map_info == None: return None
         result = map_info['levelId']
@@ -67,6 +103,12 @@ class SessionArchive():
         if event == 'hello':
             return False
 
+        if self.save_pending and not monitor.in_map and monitor.shed_level < monitor.SHED_DEFER:
+            #usually this is the next songStart, so don't make the player wait for it
+            print(f'Monitor caught up, saving deferred archive in the background')
+            self.save_pending = False
+            self.save(background=True)
+
         if monitor.in_map:
             self.add_event(message)
         
@@ -104,7 +146,11 @@ class SessionArchive():
                 data_entry['map_hash'] = map_hash
 
                 self.data.append(data_entry)
-                self.save()
+                if monitor.shed_level >= monitor.SHED_DEFER:
+                    monitor.record_shed('deferred archive saves')
+                    self.save_pending = True
+                else:
+                    self.save()
             return False
 
         if not monitor.in_map:
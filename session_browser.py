@@ -5,25 +5,19 @@ import json
 from matplotlib import widgets
 from matplotlib import pyplot as plt
 
+import archive
+
 class App():
     def __init__(self, datadir):
         self.datadir = datadir
         
-        songsfile = os.path.join(datadir, 'songs.json')
-        with open(songsfile, 'r') as fp:
-            self.songmap = songmap = json.load(fp)
-
-        self.sessions = sessions = []
-
-        _, _, filenames = next(os.walk(datadir))
-        for filename in filenames:
-            if filename == 'songs.json': continue
-            with open(os.path.join(datadir, filename), 'r') as fp:
-                tsession = json.load(fp)
-            sessions.extend(tsession)
+        #plays are read lazily from the archive when a map is selected
+        self.reader = archive.ArchiveReader(datadir)
+        self.songmap = self.reader.song_map
 
-        #extract song hashs in sessions
-        self.session_hashes = list(set([x['map_hash'] for x in sessions]))
+        #where each map's plays are, so switching only reads those plays
+        self.map_index = self.reader.index_plays()
+        self.session_hashes = list(self.map_index.keys())
         
         #ui state?
         self.selected_map = self.session_hashes[0]
@@ -58,7 +52,8 @@ class App():
         self.do_plot()
 
     def get_song_entries(self, selection):
-        data = filter(lambda x: x['map_hash'] == selection, self.sessions)
+        #the plots only look at fully cut notes
+        data = self.reader.read_plays(self.map_index[selection], events='noteFullyCut')
         return data, self.songmap[selection]
 
     def plot_timing(self, ax, entry):
@@ -118,5 +113,6 @@ class App():
         self.do_plot()
         plt.show()
 
-app = App('sessions')
-app.run()
+if __name__ == "__main__":
+    app = App('sessions')
+    app.run()
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import random
+import hashlib
+import argparse
+
+import loadgen
+
+"""
+Builds synthetic session archives in the layout record.SessionArchive writes,
+a songs.json index next to session<timestamp>.json files each holding a list
+of plays, for benchmarking the archive readers and writers at scale.
+
+Plays are generated with loadgen.SyntheticSong so event counts match real
+maps. Generating every play from scratch is slow for big archives, so a pool
+of template plays is generated per map and reused with shifted timestamps.
+"""
+
+def make_maps(base_songs, count, seed=None):
+    """
+    count maps based on the entries of base_songs with their own hashes, names
+    and lengths
+    """
+    rng = random.Random(seed)
+    base = list(base_songs.values())
+    song_map = {}
+    for idx in range(count):
+        map_info = dict(rng.choice(base))
+        song_hash = hashlib.sha1(f'synthetic{idx}'.encode()).hexdigest().upper()
+        map_info['songName'] = f'{map_info.get("songName", "Song")} #{idx}'
+        map_info['songHash'] = song_hash
+        map_info['levelId'] = f'custom_level_{song_hash}'
+        map_info['songCover'] = None
+        scale = rng.uniform(0.6, 1.6)
+        map_info['length'] = int(map_info.get('length', 120000)*scale)
+        map_info['notesCount'] = int(map_info.get('notesCount', 500)*scale)
+        map_info['obstaclesCount'] = int(map_info.get('obstaclesCount', 0)*scale)
+        map_info['difficulty'] = rng.choice(['Normal', 'Hard', 'Expert', 'Expert+'])
+        song_map[map_info['levelId']] = map_info
+    return song_map
+
+def make_play(map_info, seed):
+    """
+    One play entry like SessionArchive stores it, with times relative to 0
+    """
+    song = loadgen.SyntheticSong(map_info, event_rate=0, pauses=seed%3, seed=seed)
+    hello = loadgen.hello_message()['status']
+    events = []
+    perf = {}
+    for offset, message in song.messages():
+        #the archive only records what happens after songStart up to the end
+        if message['event'] == 'menu': break
+        perf = message['status'].get('performance', perf)
+        message['time'] = int(offset*1000)
+        message.pop('status')
+        if message['event'] != 'songStart':
+            events.append(message)
+
+    return {
+        'events': events,
+        'performance': perf,
+        'modifiers': hello['mod'],
+        'playersettings': hello['playerSettings'],
+        'gameinfo': hello['game'],
+        'map_hash': map_info['levelId'],
+        'instanceinfo': {'start_time': 0, 'difficulty': map_info['difficulty']},
+        }
+
+def shift_play(play, start_ms):
+    """
+    Serializes a template play as if it started at start_ms
+    """
+    events = [dict(x, time=x['time']+start_ms) for x in play['events']]
+    entry = dict(play, events=events)
+    entry['instanceinfo'] = dict(play['instanceinfo'], start_time=start_ms)
+    return json.dumps(entry)
+
+def build_archive(datadir, plays, base_songs, maps=50, plays_per_session=20,
+        templates=4, start=None, seed=0):
+    """
+    Writes plays plays across session files into datadir. Plays are streamed
+    out one at a time so memory use doesn't depend on the archive size.
+    """
+    os.makedirs(datadir, exist_ok=True)
+    rng = random.Random(seed)
+
+    song_map = make_maps(base_songs, maps, seed)
+    with open(os.path.join(datadir, 'songs.json'), 'w') as fp:
+        json.dump(song_map, fp)
+
+    map_infos = list(song_map.values())
+    template_cache = {}
+
+    #fixed default so repeated builds produce identical archives
+    session_start = start if start != None else 1609459200
+    written = 0
+    while written < plays:
+        name = f'session{time.strftime("%Y%m%d_%H%M%S", time.localtime(session_start))}.json'
+        play_time = session_start
+        with open(os.path.join(datadir, name), 'w') as fp:
+            fp.write('[')
+            for idx in range(min(plays_per_session, plays-written)):
+                map_info = rng.choice(map_infos)
+                key = (map_info['levelId'], rng.randrange(templates))
+                if key not in template_cache:
+                    template_seed = int(hashlib.md5(f'{key}{seed}'.encode()).hexdigest()[:8], 16)
+                    template_cache[key] = make_play(map_info, template_seed)
+                if idx > 0: fp.write(', ')
+                fp.write(shift_play(template_cache[key], int(play_time*1000)))
+                play_time += map_info['length']/1000+rng.uniform(5, 60)
+                written += 1
+            fp.write(']')
+        #next session starts a while after this one ended
+        session_start = play_time+rng.uniform(3600, 86400)
+
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic session archive')
+    parser.add_argument('datadir')
+    parser.add_argument('--plays', type=int, default=1000)
+    parser.add_argument('--songs', default='sample_data/songs.json', help='real song index to base the maps on')
+    parser.add_argument('--maps', type=int, default=50)
+    parser.add_argument('--plays-per-session', type=int, default=20)
+    parser.add_argument('--templates', type=int, default=4, help='distinct plays generated per map')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.songs, 'r') as fp:
+        base_songs = json.load(fp)
+
+    t = time.time()
+    count = build_archive(args.datadir, args.plays, base_songs, args.maps,
+        args.plays_per_session, args.templates, seed=args.seed)
+    print(f'Wrote {count} plays to {args.datadir} in {time.time()-t:.1f}s')